@@ -1,11 +1,42 @@
+import sys
+import functools
 import psutil
 import time
 import platform
 from dataclasses import dataclass
-from typing import Dict, Optional
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
 
+# resource no existe en Windows
+try:
+    import resource
+except ImportError:
+    resource = None
 
-@dataclass
+# Datos de la máquina: se resuelven una sola vez al importar el módulo
+_PLATFORM = platform.machine().lower()
+_CPU_COUNT = psutil.cpu_count() or 1
+
+
+def _read_jiffies() -> Optional[Tuple[int, int]]:
+    """
+    Lee los contadores agregados de CPU de /proc/stat (Linux).
+
+    Returns:
+        (total, idle) en jiffies, o None si /proc/stat no está disponible
+    """
+    try:
+        with open("/proc/stat", "rb") as f:
+            parts = f.readline().split()
+    except OSError:
+        return None
+    # user nice system idle iowait irq softirq; iowait cuenta como inactivo
+    total = sum(int(x) for x in parts[1:8])
+    idle = int(parts[4]) + int(parts[5])
+    return total, idle
+
+
+@dataclass(frozen=True, slots=True)
 class EnergyMetrics:
     """Métricas de energía medidas"""
 
@@ -15,6 +46,7 @@ class EnergyMetrics:
     energy_joules: float
     carbon_grams: float
     sci_score: float
+    cpu_seconds: float = 0.0  # Tiempo de CPU del proceso (user + sys)
 
 
 class EnergyEstimator:
@@ -29,6 +61,7 @@ class EnergyEstimator:
         "aarch64": 15,  # ARM (M1/M2)
         "arm64": 15,
     }
+    _DEFAULT_TDP = CPU_TDP.get(_PLATFORM, 65)
 
     # Factor de conversión CPU% -> Potencia (basado en estudios EcoCI)
     # Potencia = TDP * (CPU_util * 0.6 + 0.4)  # Modelo lineal con baseline
@@ -38,121 +71,294 @@ class EnergyEstimator:
     # RAM: ~0.375W por GB (estudios Kingston/Crucial)
     RAM_WATTS_PER_GB = 0.375
 
+    # Contadores de energía RAPL (Linux, Intel/AMD)
+    RAPL_ROOT = Path("/sys/class/powercap")
+
     def __init__(self, carbon_intensity: float = 475):
         """
         Args:
             carbon_intensity: g CO2e por kWh (default: promedio global)
         """
         self.carbon_intensity = carbon_intensity
-        self.platform = platform.machine().lower()
-        self.tdp = self.CPU_TDP.get(self.platform, 65)
+        self.platform = _PLATFORM
+        self.tdp = self._DEFAULT_TDP
+        self.rapl_domains = self._probe_rapl()
+        self._k_ram = self.RAM_WATTS_PER_GB
+
+    # Evaluación parcial del modelo: los coeficientes se recalculan solo al
+    # cambiar TDP o intensidad, así cada cálculo queda en pocas multiplicaciones
+    @property
+    def tdp(self) -> float:
+        """TDP de la CPU (Watts)"""
+        return self._tdp
+
+    @tdp.setter
+    def tdp(self, value: float):
+        self._tdp = value
+        self._k_cpu = value * self.CPU_POWER_FACTOR / 100  # por punto de CPU%
+        self._k_base = value * self.CPU_BASELINE
+
+    @property
+    def carbon_intensity(self) -> float:
+        """Intensidad de carbono (g CO2e por kWh)"""
+        return self._carbon_intensity
+
+    @carbon_intensity.setter
+    def carbon_intensity(self, value: float):
+        self._carbon_intensity = value
+        self._k_carbon = value / 3_600_000  # g CO2e por joule
+
+    def _probe_rapl(self) -> List[Tuple[Path, int]]:
+        """
+        Detecta dominios RAPL de paquete legibles.
+
+        Returns:
+            Lista de (ruta energy_uj, max_energy_range_uj); vacía si no hay RAPL
+        """
+        domains = []
+        # Solo zonas de paquete (intel-rapl:N con name "package-N"): los
+        # subdominios (intel-rapl:N:M) ya están incluidos en el paquete y
+        # psys (energía de plataforma) lo incluye a él
+        for domain in sorted(self.RAPL_ROOT.glob("intel-rapl:*")):
+            if domain.name.count(":") != 1:
+                continue
+            try:
+                if not (domain / "name").read_text().startswith("package-"):
+                    continue
+                int((domain / "energy_uj").read_text())
+                max_range = int((domain / "max_energy_range_uj").read_text())
+            except (OSError, ValueError):
+                # Sin permisos (root) o dominio incompleto
+                continue
+            domains.append((domain / "energy_uj", max_range))
+        return domains
+
+    def _read_rapl(self) -> List[int]:
+        """Lee los contadores energy_uj de cada dominio RAPL"""
+        return [int(path.read_text()) for path, _ in self.rapl_domains]
 
     def measure_execution(self, func, *args, **kwargs):
         """
         Mide el consumo energético de una función durante su ejecución.
 
+        El uso de CPU del sistema se obtiene comparando /proc/stat antes y
+        después de la ejecución; sin /proc se usa el tiempo de CPU del
+        proceso (process_time_ns). No hay thread de muestreo.
+
         Returns:
             tuple: (resultado_funcion, EnergyMetrics)
         """
-        # Mediciones iniciales
-        cpu_samples = []
-        memory_samples = []
-        start_time = time.time()
-
-        # Muestreo durante ejecución (cada 0.1s)
-        def sample_metrics():
-            while getattr(sample_metrics, "running", True):
-                cpu_samples.append(psutil.cpu_percent(interval=0.1))
-                memory_samples.append(psutil.virtual_memory().used / (1024**3))  # GB
-                time.sleep(0.1)
-
-        # Thread para muestreo paralelo
-        import threading
-
-        sample_thread = threading.Thread(target=sample_metrics, daemon=True)
-        sample_thread.start()
-
-        try:
-            # Ejecutar función
-            result = func(*args, **kwargs)
-        finally:
-            sample_metrics.running = False
-            sample_thread.join(timeout=1)
-
-        duration = time.time() - start_time
-
-        # Calcular promedios
-        avg_cpu = sum(cpu_samples) / len(cpu_samples) if cpu_samples else 0
-        avg_memory_gb = (
-            sum(memory_samples) / len(memory_samples) if memory_samples else 0
-        )
+        # perf_counter: monótono y de alta resolución (no afectado por NTP)
+        start_time = time.perf_counter()
+        cpu_start = time.process_time_ns()
+        rapl_start = self._read_rapl()
+        jiffies_start = _read_jiffies()
+
+        # Ejecutar función
+        result = func(*args, **kwargs)
+
+        cpu_seconds = (time.process_time_ns() - cpu_start) / 1e9
+        duration = time.perf_counter() - start_time
+        rapl_end = self._read_rapl()
+        jiffies_end = _read_jiffies()
+
+        # Energía real del paquete: diferencia de contadores con desborde
+        measured_joules = None
+        if self.rapl_domains:
+            delta_uj = sum(
+                (end - start) % max_range
+                for start, end, (_, max_range) in zip(
+                    rapl_start, rapl_end, self.rapl_domains
+                )
+            )
+            measured_joules = delta_uj / 1e6
+
+        # CPU% promedio del sistema: fracción de jiffies no inactivos
+        total_jiffies = idle_jiffies = 0
+        if jiffies_start and jiffies_end:
+            total_jiffies = jiffies_end[0] - jiffies_start[0]
+            idle_jiffies = jiffies_end[1] - jiffies_start[1]
+
+        if total_jiffies > 0:
+            avg_cpu = 100 * (1 - idle_jiffies / total_jiffies)
+        elif duration > 0:
+            # Sin /proc o ejecución < 1 jiffy: segundos de CPU / (wall * núcleos)
+            avg_cpu = cpu_seconds / duration / _CPU_COUNT * 100
+        else:
+            avg_cpu = 0
+
+        # Pico de RAM del proceso actual (no de todo el sistema)
+        memory_gb = self._peak_memory_gb()
 
         # Calcular energía
-        metrics = self._calculate_energy(duration, avg_cpu, avg_memory_gb)
+        metrics = _calculate_energy(
+            duration,
+            avg_cpu,
+            memory_gb,
+            self._k_cpu,
+            self._k_base,
+            self._k_ram,
+            self._k_carbon,
+            energy_joules=measured_joules,
+            cpu_seconds=cpu_seconds,
+        )
 
         return result, metrics
 
-    def _calculate_energy(
-        self, duration: float, cpu_percent: float, memory_gb: float
+    @staticmethod
+    def _peak_memory_gb() -> float:
+        """Pico de memoria residente del proceso actual (GB)"""
+        if resource is None:
+            return psutil.Process().memory_info().rss / (1024**3)
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss viene en KB en Linux y en bytes en macOS
+        if sys.platform == "darwin":
+            return maxrss / (1024**3)
+        return maxrss / (1024**2)
+
+    def estimate_from_metrics(
+        self, duration: float, cpu_percent: float, memory_mb: float
     ) -> EnergyMetrics:
         """
-        Calcula energía usando modelo de potencia.
+        Estima energía desde métricas ya capturadas.
+        Útil para integración con CI/CD que ya tiene métricas.
 
-        Modelo:
-        P_cpu = TDP * (CPU_util * 0.6 + 0.4)
-        P_ram = RAM_GB * 0.375W
-        E = (P_cpu + P_ram) * duration
+        Las entradas se redondean (10 ms, 0.1% CPU, 1 MB) para que pasos
+        con métricas equivalentes reutilicen el resultado en caché.
         """
-        # Normalizar CPU% (0-100 -> 0-1)
-        cpu_util = cpu_percent / 100.0
+        return _estimate_energy_cached(
+            round(duration, 2),
+            round(cpu_percent, 1),
+            round(memory_mb),
+            self._k_cpu,
+            self._k_base,
+            self._k_ram,
+            self._k_carbon,
+        )
+
 
-        # Potencia CPU (watts)
-        cpu_power = self.tdp * (cpu_util * self.CPU_POWER_FACTOR + self.CPU_BASELINE)
+def _calculate_energy(
+    duration: float,
+    cpu_percent: float,
+    memory_gb: float,
+    k_cpu: float,
+    k_base: float,
+    k_ram: float,
+    k_carbon: float,
+    energy_joules: Optional[float] = None,
+    cpu_seconds: float = 0.0,
+) -> EnergyMetrics:
+    """
+    Calcula energía usando modelo de potencia.
 
-        # Potencia RAM (watts)
-        ram_power = memory_gb * self.RAM_WATTS_PER_GB
+    Modelo:
+    P_cpu = TDP * (CPU_util * 0.6 + 0.4)
+    P_ram = RAM_GB * 0.375W
+    E = (P_cpu + P_ram) * duration
 
-        # Potencia total
-        total_power_watts = cpu_power + ram_power
+    Recibe las constantes ya evaluadas por EnergyEstimator:
+    k_cpu = TDP * 0.6 / 100, k_base = TDP * 0.4, k_ram = 0.375,
+    k_carbon = intensidad / 3.6e6 (g CO2e por joule).
 
+    Si se pasa energy_joules (medida RAPL) se usa en lugar del modelo.
+    """
+    if energy_joules is None:
         # Energía (joules) = Power(W) * time(s)
-        energy_joules = total_power_watts * duration
-
-        # Energía (kWh)
-        energy_kwh = energy_joules / 3600000
+        energy_joules = (k_cpu * cpu_percent + k_base + k_ram * memory_gb) * duration
 
-        # Carbono (gramos CO2e)
-        carbon_grams = energy_kwh * self.carbon_intensity
+    # Carbono (gramos CO2e)
+    carbon_grams = energy_joules * k_carbon
 
+    return EnergyMetrics(
+        duration_seconds=duration,
+        cpu_percent=cpu_percent,
+        memory_mb=memory_gb * 1024,
+        energy_joules=energy_joules,
+        carbon_grams=carbon_grams,
         # SCI Score simplificado (g CO2e por ejecución)
-        sci_score = carbon_grams
-
-        return EnergyMetrics(
-            duration_seconds=duration,
-            cpu_percent=cpu_percent,
-            memory_mb=memory_gb * 1024,
-            energy_joules=energy_joules,
-            carbon_grams=carbon_grams,
-            sci_score=sci_score,
-        )
+        sci_score=carbon_grams,
+        cpu_seconds=cpu_seconds,
+    )
 
-    def estimate_from_metrics(
-        self, duration: float, cpu_percent: float, memory_mb: float
-    ) -> EnergyMetrics:
-        """
-        Estima energía desde métricas ya capturadas.
-        Útil para integración con CI/CD que ya tiene métricas.
-        """
-        return self._calculate_energy(duration, cpu_percent, memory_mb / 1024)
+
+# EnergyMetrics es inmutable, así que el resultado se puede compartir
+@functools.lru_cache(maxsize=2048)
+def _estimate_energy_cached(
+    duration: float,
+    cpu_percent: float,
+    memory_mb: float,
+    k_cpu: float,
+    k_base: float,
+    k_ram: float,
+    k_carbon: float,
+) -> EnergyMetrics:
+    """_calculate_energy en caché; recibe la memoria en MB enteros"""
+    return _calculate_energy(
+        duration, cpu_percent, memory_mb / 1024, k_cpu, k_base, k_ram, k_carbon
+    )
 
 
 # Ejemplo de uso
 if __name__ == "__main__":
-    # Test con función simple
-    def heavy_computation():
-        """Simula carga computacional"""
-        result = sum([i**2 for i in range(10_000_000)])
-        return result
+    import argparse
+
+    N = 10_000_000
+
+    def heavy_computation_slow(n=N):
+        """Versión original: lista de n enteros en memoria antes de sumar"""
+        return sum([i**2 for i in range(n)])
+
+    def heavy_computation(n=N):
+        """Suma de cuadrados 0..n-1 en forma cerrada (O(1), exacta)"""
+        return n * (n - 1) * (2 * n - 1) // 6
+
+    def heavy_computation_numpy(n=N):
+        """Línea base numérica vectorizada (float64: int64 desborda con n=10M)"""
+        a = np.arange(n, dtype=np.float64)
+        return (a * a).sum()
+
+    # Numba es opcional: sin él el kernel corre en CPython
+    try:
+        from numba import njit
+    except ImportError:
+
+        def njit(*args, **kwargs):
+            return lambda func: func
+
+    @njit(cache=True)
+    def heavy_computation_kernel(n):
+        """Suma de cuadrados (acumulador float64: int64 desborda con n=10M)"""
+        s = 0.0
+        for i in range(n):
+            s += i * i
+        return s
+
+    def heavy_computation_numba(n=N):
+        """Bucle compilado con Numba"""
+        return heavy_computation_kernel(n)
+
+    parser = argparse.ArgumentParser(description="Demo del estimador de energía")
+    variant = parser.add_mutually_exclusive_group()
+    variant.add_argument("--slow", action="store_true", help="Versión original")
+    variant.add_argument("--numpy", action="store_true", help="Versión NumPy")
+    variant.add_argument("--numba", action="store_true", help="Versión Numba")
+    args = parser.parse_args()
+
+    if args.slow:
+        workload = heavy_computation_slow
+    elif args.numpy:
+        # NumPy es opcional: solo se necesita para esta variante
+        try:
+            import numpy as np
+        except ImportError:
+            parser.error("--numpy requiere numpy (pip install numpy)")
+        workload = heavy_computation_numpy
+    elif args.numba:
+        workload = heavy_computation_numba
+        # Calentar el JIT para excluir la compilación de la medición
+        heavy_computation_kernel(1)
+    else:
+        workload = heavy_computation
 
     estimator = EnergyEstimator(carbon_intensity=420)  # Alemania promedio
 
@@ -160,16 +366,19 @@ if __name__ == "__main__":
     print("=" * 50)
     print(f"Platform: {estimator.platform}")
     print(f"CPU TDP: {estimator.tdp}W")
+    print(f"Energía: {'RAPL' if estimator.rapl_domains else 'modelo TDP'}")
     print(f"Carbon Intensity: {estimator.carbon_intensity}g CO2e/kWh")
+    print(f"Workload: {workload.__name__}")
     print("=" * 50)
     print("\n⚡ Midiendo ejecución...\n")
 
-    result, metrics = estimator.measure_execution(heavy_computation)
+    result, metrics = estimator.measure_execution(workload)
 
     print("📊 Resultados:")
     print(f"  Duración:     {metrics.duration_seconds:.2f} segundos")
     print(f"  CPU promedio: {metrics.cpu_percent:.1f}%")
-    print(f"  RAM promedio: {metrics.memory_mb:.0f} MB")
+    print(f"  Tiempo CPU:   {metrics.cpu_seconds:.2f} segundos")
+    print(f"  RAM pico:     {metrics.memory_mb:.0f} MB")
     print(f"  Energía:      {metrics.energy_joules:.2f} joules")
     print(f"  Carbono:      {metrics.carbon_grams:.4f} g CO2e")
     print(f"  SCI Score:    {metrics.sci_score:.4f}")
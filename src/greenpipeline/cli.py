@@ -1,12 +1,97 @@
 
+import os
 import sys
 import subprocess
 import argparse
 import json
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from operator import itemgetter
 from pathlib import Path
 
+# orjson es opcional (extra "fast"): serializa más rápido y produce bytes
+try:
+    import orjson
+
+    def _dumps_line(data: dict) -> bytes:
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+
+    _loads = orjson.loads
+except ImportError:
+
+    def _dumps_line(data: dict) -> bytes:
+        return (json.dumps(data) + "\n").encode()
+
+    _loads = json.loads
+
+
+def _maxrss_mb(usage) -> float:
+    """Pico de memoria residente (MB) de un struct rusage"""
+    maxrss = usage.ru_maxrss
+    # ru_maxrss viene en KB en Linux y en bytes en macOS
+    if sys.platform == "darwin":
+        return maxrss / (1024**2)
+    return maxrss / 1024
+
+
+# Bytes conservados del inicio de cada línea (solo se muestran 70 caracteres)
+_TAIL_LINE_BYTES = 4096
+
+
+def _read_tail(fd: int, max_lines: int = 5) -> list:
+    """
+    Consume un pipe en bloques de 64 KB y conserva solo las últimas líneas,
+    cada una recortada a sus primeros _TAIL_LINE_BYTES bytes.
+    Solo esas líneas se decodifican a texto.
+    """
+    tail = deque(maxlen=max_lines)
+    # Inicio acotado de la línea incompleta: output sin saltos (binario,
+    # barras de progreso) no crece en memoria ni se recopia en cada bloque
+    pending = bytearray()
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        # \r: barras de progreso que redibujan la misma línea
+        *lines, last = chunk.replace(b"\r", b"\n").split(b"\n")
+        if lines:
+            pending += lines[0][: _TAIL_LINE_BYTES - len(pending)]
+            lines[0] = bytes(pending)
+            tail.extend(filter(None, lines))
+            pending = bytearray(last[:_TAIL_LINE_BYTES])
+        elif len(pending) < _TAIL_LINE_BYTES:
+            pending += last[: _TAIL_LINE_BYTES - len(pending)]
+    if pending:
+        tail.append(bytes(pending))
+    # Las líneas completas caben en un bloque: se recortan igual al final
+    return [line[:_TAIL_LINE_BYTES].decode(errors="replace") for line in tail]
+
+
+# Intensidad de carbono simulada por ubicación (g CO2e/kWh)
+# En producción se reemplaza por CarbonIntensityAPI
+_CARBON_INTENSITY_TABLE = {
+    "DE": 420,
+    "CO": 165,
+    "US-CA": 250,
+    "FR": 55,
+    "GLOBAL": 389,
+}
+
+# Equivalencias por gramo de CO2e (factores precalculados)
+_SMARTPHONE_CHARGES_PER_GRAM = 1000 / 0.062
+_KM_DRIVEN_PER_GRAM = 1 / 192  # Auto promedio 192g/km
+
+
+def _equivalents(carbon_grams: float) -> dict:
+    """Equivalencias de emisiones en términos cotidianos"""
+    return {
+        "smartphone_charges": round(carbon_grams * _SMARTPHONE_CHARGES_PER_GRAM, 1),
+        "km_driven": round(carbon_grams * _KM_DRIVEN_PER_GRAM, 3),
+    }
+
+
 # Simulación de imports (en producción serían módulos separados)
 # from estimator import EnergyEstimator
 # from carbon_intensity import CarbonIntensityAPI
@@ -15,12 +100,44 @@ from pathlib import Path
 class GreenPipelineCLI:
     """CLI principal de GreenPipeline"""
 
+    # Historial en JSON Lines: se muestran las últimas 100 ejecuciones y el
+    # archivo se compacta cuando supera 2000 líneas
+    HISTORY_LIMIT = 100
+    HISTORY_COMPACT_LINES = 2000
+
     def __init__(self):
-        self.results_file = Path.home() / ".greenpipeline" / "history.json"
+        self.results_file = Path.home() / ".greenpipeline" / "history.jsonl"
         self.results_file.parent.mkdir(exist_ok=True)
+        self._migrate_legacy_history()
+
+    def _migrate_legacy_history(self):
+        """Convierte una única vez el history.json de versiones anteriores"""
+        legacy_file = self.results_file.with_suffix(".json")
+        if self.results_file.exists() or not legacy_file.exists():
+            return
+
+        try:
+            with open(legacy_file, "rb") as f:
+                history = _loads(f.read())
+        except (OSError, ValueError) as e:
+            print(f"⚠️  No se pudo migrar {legacy_file}: {e}")
+            return
+
+        tmp_file = self.results_file.with_suffix(".jsonl.tmp")
+        with open(tmp_file, "wb") as f:
+            f.writelines(_dumps_line(entry) for entry in history)
+        tmp_file.replace(self.results_file)
+
+        # Se conserva una copia del archivo original
+        legacy_file.replace(legacy_file.with_suffix(".json.bak"))
 
     def run_command(
-        self, command: str, location: str = "GLOBAL", save_history: bool = True
+        self,
+        command: str,
+        location: str = "GLOBAL",
+        save_history: bool = True,
+        verbose: bool = True,
+        quiet: bool = False,
     ) -> dict:
         """
         Ejecuta un comando y mide su impacto energético.
@@ -29,43 +146,96 @@ class GreenPipelineCLI:
             command: Comando a ejecutar (ej: "npm test")
             location: Ubicación para intensidad de carbono
             save_history: Si guardar en historial
+            verbose: Si imprimir progreso y resultados
+            quiet: Si descartar el output del comando sin capturarlo
 
         Returns:
             Dict con métricas y resultados
         """
-        print(f"🌱 GreenPipeline - Midiendo: {command}")
-        print("=" * 60)
+        return self._measure_command(
+            command,
+            location=location,
+            save_history=save_history,
+            verbose=verbose,
+            quiet=quiet,
+        )[0]
+
+    def _measure_command(
+        self,
+        command: str,
+        location: str = "GLOBAL",
+        save_history: bool = True,
+        verbose: bool = True,
+        quiet: bool = False,
+    ) -> tuple:
+        """
+        Implementación de run_command.
 
+        Returns:
+            tuple: (dict de resultados, energía en joules sin redondear)
+        """
         # 1. Obtener intensidad de carbono actual
-        print(f"📍 Ubicación: {location}")
         # carbon_api = CarbonIntensityAPI()
         # carbon_data = carbon_api.get_current_intensity(location)
+        carbon_intensity = self._get_carbon_intensity(location)
 
-        # Simulación (en producción usaría la API real)
-        carbon_intensity = 420 if location == "DE" else 165 if location == "CO" else 389
-        print(f"🌍 Intensidad de carbono: {carbon_intensity} g CO2e/kWh")
+        if verbose:
+            print(f"🌱 GreenPipeline - Midiendo: {command}")
+            print("=" * 60)
+            print(f"📍 Ubicación: {location}")
+            print(f"🌍 Intensidad de carbono: {carbon_intensity} g CO2e/kWh")
+            print(f"\n⚡ Ejecutando comando...\n")
 
         # 2. Ejecutar comando con medición
-        print(f"\n⚡ Ejecutando comando...\n")
-        start_time = time.time()
+        # perf_counter: monótono y de alta resolución (no afectado por NTP)
+        start_time = time.perf_counter()
+        usage = None
 
         try:
-            # Ejecutar comando real
-            result = subprocess.run(command, shell=True, capture_output=True, text=True)
-            success = result.returncode == 0
-            output = result.stdout if success else result.stderr
+            # Ejecutar comando real; el output se consume en streaming y solo
+            # se conservan las últimas líneas que se muestran. Con quiet va
+            # directo a /dev/null y nunca pasa por Python
+            proc = subprocess.Popen(
+                command,
+                shell=True,
+                stdout=subprocess.DEVNULL if quiet else subprocess.PIPE,
+                stderr=subprocess.DEVNULL if quiet else subprocess.STDOUT,
+            )
+            tail = []
+            if proc.stdout is not None:
+                with proc.stdout:
+                    tail = _read_tail(proc.stdout.fileno())
+            if hasattr(os, "wait4"):
+                # wait4 devuelve el rusage de este hijo (y de sus descendientes
+                # ya recogidos), aunque haya otros comandos en paralelo
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+            else:
+                proc.wait()
+            success = proc.returncode == 0
+            output = "\n".join(tail)
 
         except Exception as e:
             success = False
             output = str(e)
 
-        duration = time.time() - start_time
+        duration = time.perf_counter() - start_time
 
         # 3. Simular medición de energía
         # En producción: estimator.measure_execution(...)
         # Para MVP, simulamos basado en duración
-        cpu_percent = 45.0  # Promedio estimado
-        memory_mb = 512.0
+        if usage is None:
+            cpu_percent = 45.0  # Promedio estimado
+            memory_mb = 512.0
+        else:
+            # CPU% promedio: segundos de CPU del hijo / (wall * núcleos)
+            cores = os.cpu_count() or 1
+            child_cpu = usage.ru_utime + usage.ru_stime
+            cpu_percent = (
+                round(child_cpu / duration / cores * 100, 1) if duration > 0 else 0.0
+            )
+            # Pico de RAM del hijo (mantenido por el kernel)
+            memory_mb = round(_maxrss_mb(usage), 1)
 
         energy_joules = duration * 25  # ~25W promedio * tiempo
         energy_kwh = energy_joules / 3600000
@@ -86,20 +256,23 @@ class GreenPipelineCLI:
                 "carbon_grams": round(carbon_grams, 4),
                 "carbon_intensity": carbon_intensity,
             },
-            "equivalents": {
-                "smartphone_charges": round((carbon_grams * 1000) / 0.062, 1),
-                "km_driven": round(carbon_grams / 192, 3),  # Auto promedio 192g/km
-            },
+            "equivalents": _equivalents(carbon_grams),
         }
 
         # 5. Mostrar resultados
-        self._print_results(result_data, output, success)
+        if verbose:
+            self._print_results(result_data, output, success)
 
         # 6. Guardar historial
         if save_history:
             self._save_to_history(result_data)
 
-        return result_data
+        return result_data, energy_joules
+
+    @staticmethod
+    def _get_carbon_intensity(location: str) -> float:
+        """Intensidad de carbono (g CO2e/kWh) para una ubicación"""
+        return _CARBON_INTENSITY_TABLE.get(location, _CARBON_INTENSITY_TABLE["GLOBAL"])
 
     def _print_results(self, data: dict, output: str, success: bool):
         """Imprime resultados formateados"""
@@ -145,22 +318,31 @@ class GreenPipelineCLI:
         print("=" * 60)
 
     def _save_to_history(self, data: dict):
-        """Guarda ejecución en historial local"""
-        history = []
+        """Guarda ejecución en historial local (una línea JSON por ejecución)"""
+        with open(self.results_file, "ab") as f:
+            f.write(_dumps_line(data))
 
-        if self.results_file.exists():
-            with open(self.results_file, "r") as f:
-                history = json.load(f)
+        print(f"💾 Guardado en: {self.results_file}")
 
-        history.append(data)
+    def _load_history(self) -> list:
+        """
+        Lee las últimas HISTORY_LIMIT ejecuciones del historial.
+        Compacta el archivo si supera HISTORY_COMPACT_LINES líneas.
+        """
+        with open(self.results_file, "rb") as f:
+            # enumerate permite contar líneas sin guardarlas todas
+            numbered = deque(enumerate(f, 1), maxlen=self.HISTORY_LIMIT)
 
-        # Mantener últimas 100 ejecuciones
-        history = history[-100:]
+        line_count = numbered[-1][0] if numbered else 0
+        lines = [line for _, line in numbered if line.strip()]
 
-        with open(self.results_file, "w") as f:
-            json.dump(history, f, indent=2)
+        if line_count > self.HISTORY_COMPACT_LINES:
+            tmp_file = self.results_file.with_suffix(".jsonl.tmp")
+            with open(tmp_file, "wb") as f:
+                f.writelines(lines)
+            tmp_file.replace(self.results_file)
 
-        print(f"💾 Guardado en: {self.results_file}")
+        return [_loads(line) for line in lines]
 
     def show_history(self, limit: int = 10):
         """Muestra historial de ejecuciones"""
@@ -168,34 +350,55 @@ class GreenPipelineCLI:
             print("📭 No hay historial aún")
             return
 
-        with open(self.results_file, "r") as f:
-            history = json.load(f)
+        history = self._load_history()
 
         print(f"\n📜 HISTORIAL (últimas {limit} ejecuciones)")
         print("=" * 80)
 
-        for entry in history[-limit:]:
-            timestamp = entry["timestamp"][:19]
-            cmd = entry["command"][:30]
-            duration = entry["duration_seconds"]
-            carbon = entry["metrics"]["carbon_grams"]
+        entry_fields = itemgetter("timestamp", "command", "duration_seconds")
+        carbon_of = itemgetter("carbon_grams")
+        energy_of = itemgetter("energy_joules")
+        metrics = list(map(itemgetter("metrics"), history))
 
-            print(f"{timestamp} | {cmd:30} | {duration:5.1f}s | {carbon:8.4f}g CO2e")
+        # Todas las filas en una sola escritura
+        rows = [
+            f"{timestamp[:19]} | {cmd[:30]:30} | {duration:5.1f}s | {carbon:8.4f}g CO2e"
+            for (timestamp, cmd, duration), carbon in zip(
+                map(entry_fields, history[-limit:]), map(carbon_of, metrics[-limit:])
+            )
+        ]
+        if rows:
+            sys.stdout.write("\n".join(rows) + "\n")
 
         # Estadísticas totales
-        total_carbon = sum(e["metrics"]["carbon_grams"] for e in history)
-        total_energy = sum(e["metrics"]["energy_joules"] for e in history)
+        total_carbon = sum(map(carbon_of, metrics))
+        total_energy = sum(map(energy_of, metrics))
 
         print("=" * 80)
         print(f"📊 Total: {len(history)} ejecuciones")
         print(f"💨 Emisiones acumuladas: {total_carbon:.2f}g CO2e")
         print(f"⚡ Energía acumulada: {total_energy:.0f} joules")
         print(
-            f"📱 Equivalente a: {(total_carbon * 1000 / 0.062):.0f} cargas de smartphone"
+            f"📱 Equivalente a: {total_carbon * _SMARTPHONE_CHARGES_PER_GRAM:.0f}"
+            " cargas de smartphone"
         )
 
-    def compare_locations(self, command: str):
-        """Compara el mismo comando en diferentes ubicaciones"""
+    def compare_locations(
+        self,
+        command: str,
+        rerun: bool = False,
+        parallel: bool = False,
+        quiet: bool = False,
+    ):
+        """
+        Compara el mismo comando en diferentes ubicaciones.
+
+        Por defecto el comando se ejecuta una sola vez y su energía se
+        multiplica por la intensidad de cada ubicación; con rerun=True se
+        ejecuta una vez por ubicación (mediciones independientes), y con
+        parallel=True esas ejecuciones son concurrentes (solo para comandos
+        idempotentes). Con quiet se descarta el output del comando.
+        """
         locations = [
             ("Colombia", "CO"),
             ("Alemania", "DE"),
@@ -207,21 +410,48 @@ class GreenPipelineCLI:
         print(f"Comando: {command}")
         print("=" * 80)
 
-        results = []
-        for name, code in locations:
-            result = self.run_command(command, location=code, save_history=False)
-            results.append((name, result))
-            time.sleep(1)  # Pequeña pausa entre ejecuciones
+        if parallel:
+            with ThreadPoolExecutor(max_workers=len(locations)) as executor:
+                results = list(
+                    executor.map(
+                        # Sin resultados individuales: el output no se captura
+                        lambda code: self.run_command(
+                            command,
+                            location=code,
+                            save_history=False,
+                            verbose=False,
+                            quiet=True,
+                        ),
+                        [code for _, code in locations],
+                    )
+                )
+            carbons = [r["metrics"]["carbon_grams"] for r in results]
+        elif rerun:
+            carbons = [
+                self.run_command(
+                    command, location=code, save_history=False, quiet=quiet
+                )["metrics"]["carbon_grams"]
+                for _, code in locations
+            ]
+        else:
+            # Solo cambia la intensidad de carbono: basta una ejecución
+            # Energía sin redondear: en comandos cortos la redondeada es 0 J
+            _, energy_joules = self._measure_command(
+                command, location="GLOBAL", save_history=False, quiet=quiet
+            )
+            energy_kwh = energy_joules / 3600000
+            carbons = [
+                energy_kwh * self._get_carbon_intensity(code) for _, code in locations
+            ]
 
         # Mostrar comparación
         print("\n📊 COMPARACIÓN DE EMISIONES:")
         print("=" * 80)
 
-        baseline = results[0][1]["metrics"]["carbon_grams"]
+        baseline = carbons[0]
 
-        for name, result in results:
-            carbon = result["metrics"]["carbon_grams"]
-            diff_percent = ((carbon - baseline) / baseline) * 100
+        for (name, _), carbon in zip(locations, carbons):
+            diff_percent = ((carbon - baseline) / baseline) * 100 if baseline else 0.0
             diff_emoji = "📈" if diff_percent > 0 else "📉"
 
             print(
@@ -238,8 +468,11 @@ def main():
 Ejemplos:
   greenpipeline run "npm test" --location CO
   greenpipeline run "python -m pytest" --location US-CA
+  greenpipeline run "npm run build" --quiet
   greenpipeline history
   greenpipeline compare "npm run build"
+  greenpipeline compare "npm run build" --rerun
+  greenpipeline compare "npm install" --parallel
         """,
     )
 
@@ -251,6 +484,9 @@ Ejemplos:
     run_parser.add_argument(
         "--location", "-l", default="GLOBAL", help="Ubicación (CO, US, DE, etc)"
     )
+    run_parser.add_argument(
+        "--quiet", "-q", action="store_true", help="Descartar el output del comando"
+    )
 
     # Comando: history
     subparsers.add_parser("history", help="Mostrar historial")
@@ -260,6 +496,19 @@ Ejemplos:
         "compare", help="Comparar en diferentes ubicaciones"
     )
     compare_parser.add_argument("cmd", help="Comando a comparar")
+    compare_parser.add_argument(
+        "--rerun",
+        action="store_true",
+        help="Ejecutar el comando una vez por ubicación (mediciones independientes)",
+    )
+    compare_parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Como --rerun, pero en paralelo (solo comandos idempotentes)",
+    )
+    compare_parser.add_argument(
+        "--quiet", "-q", action="store_true", help="Descartar el output del comando"
+    )
 
     args = parser.parse_args()
 
@@ -270,11 +519,13 @@ Ejemplos:
     cli = GreenPipelineCLI()
 
     if args.command == "run":
-        cli.run_command(args.cmd, location=args.location)
+        cli.run_command(args.cmd, location=args.location, quiet=args.quiet)
 
     elif args.command == "history":
         cli.show_history()
 
     elif args.command == "compare":
-        cli.compare_locations(args.cmd)
+        cli.compare_locations(
+            args.cmd, rerun=args.rerun, parallel=args.parallel, quiet=args.quiet
+        )
 